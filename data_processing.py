@@ -7,13 +7,18 @@ detectGPT and noted as such. Their original code can be found here:
 https://github.com/eric-mitchell/detect-gpt
 """
 
+import numpy as np
 import pandas as pd
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import openai
 import os
+import re
+import threading
 
 # housekeeping some global vars
 USAGE = 0
+USAGE_LOCK = threading.Lock()   # repair_dataframe prompts from several threads
 FAILSTRING = 'Failed response.'
 SYSTEM = {'role': 'system', 'content': 'You are a helpful assistant.'}   # a default system msg to use for all prompts 
 CONTINUE = {'role': 'user', 'content': 'Please, continue.'}
@@ -24,7 +29,7 @@ def load_data(filename, k=None):
     Expects that the dfs loaded in has 'original, sampled'
     columns and ignores other columns.
     """
-    df = pd.read_csv(filename)
+    df = pd.read_csv(filename, engine='pyarrow')   # multithreaded native parse
     assert 'original' in df.columns and 'sampled' in df.columns, 'files need to have original and sampled cols'
     print(f'Loading data from {filename}.')
     conv = {'original': df['original'].values.tolist(),
@@ -35,11 +40,14 @@ def load_data(filename, k=None):
     conv['sampled'] = conv['sampled'][:min(k, len(conv['sampled']))]
     return conv
 
-def concat_cols(row, cols):
-    string = ''
-    for col in cols:
-        string += row[col] + ' '
-    return string.strip()
+def concat_cols(frame, cols):
+    """Fallback for joining columns through numpy's vectorized string
+    kernels; the merge path uses str.cat, this covers frames whose
+    columns need coercing to str first."""
+    joined = frame[cols[0]].to_numpy(dtype=str)
+    for col in cols[1:]:
+        joined = np.char.add(np.char.add(joined, ' '), frame[col].to_numpy(dtype=str))
+    return np.char.strip(joined)
 
 
 def match_lengths(data: pd.DataFrame, col1: str, col2: str):
@@ -67,54 +75,67 @@ def remove_failed_responses(file):
     df.to_csv(file, index=False)
     print(f'removed {len(idxs)} responses from {file}')
 
+# fixed replacement pairs for process_spaces, folded into one compiled pattern
+# so each story gets scanned once instead of once per pair
+_SPACE_FIXES = {
+    ' ,': ',', ' .': '.', ' ?': '?', ' !': '!', ' ;': ';',
+    ' \'': '\'', ' ’ ': '\'', ' :': ':', '`` ': '"', ' \'\'': '"',
+    '\'\'': '"', '.. ': '... ', ' )': ')', '( ': '(', ' n\'t': 'n\'t',
+    ' i\'': ' I\'', '\\\'': '\'',
+}
+_SPACE_RE = re.compile('|'.join([re.escape(fix) for fix in sorted(_SPACE_FIXES, key=len, reverse=True)]
+                                + [r' i(?= )',    # ' i ' -> ' I ' without eating the trailing space
+                                   r'\s{2,}|\n']))  # collapse any whitespace run (incl. newlines) to one space
+
+def _fix_space(match):
+    fix = match.group(0)
+    if fix in _SPACE_FIXES:
+        return _SPACE_FIXES[fix]
+    return ' ' if fix.isspace() else ' I'
+
 def process_spaces(story: str):
     """Basic processing function, adapted from Mitchell et al."""
-    return story.replace(
-        ' ,', ',').replace(
-        ' .', '.').replace(
-        ' ?', '?').replace(
-        ' !', '!').replace(
-        ' ;', ';').replace(
-        ' \'', '\'').replace(
-        ' ’ ', '\'').replace(
-        ' :', ':').replace(
-        '<newline>', '\n').replace(
-        '`` ', '"').replace(
-        ' \'\'', '"').replace(
-        '\'\'', '"').replace(
-        '.. ', '... ').replace(
-        ' )', ')').replace(
-        '( ', '(').replace(
-        ' n\'t', 'n\'t').replace(
-        ' i ', ' I ').replace(
-        ' i\'', ' I\'').replace(
-        '\\\'', '\'').replace(
-        '\n ', ' ').replace(
-        '\n', ' ').replace(
-        '  ', ' ').strip()
-
-
-def repair_dataframe(data: pd.DataFrame, temp: float, min_words=200, prompt_msg=''):
+    return _SPACE_RE.sub(_fix_space, story.replace('<newline>', '\n')).strip()
+
+def process_spaces_series(texts: pd.Series) -> pd.Series:
+    """
+    Column-level version of process_spaces: one vectorized pass over a
+    whole Series instead of a Python call per element. Use this when
+    cleaning a full column; process_spaces stays for single strings.
+    """
+    texts = texts.str.replace('<newline>', '\n', regex=False)
+    return texts.str.replace(_SPACE_RE, _fix_space, regex=True).str.strip()
+
+
+def repair_dataframe(data: pd.DataFrame, temp: float, min_words=200, prompt_msg='', max_workers=8):
     """
     DESC: Repair dataframe that has incomplete responses from ChatGPT.
+    Failed rows are re-queried in a thread pool since the time all goes
+    to waiting on the API, not computing.
     PARAMS:
     data: a dataFrame that has both a 'prompts' and 'responses' column
-    chatbot: logged in ChatGPT
-    verbose: print chatGPT's responses while querying 
+    temp, min_words, prompt_msg: for prompting ChatGPT again
+    max_workers: number of querying threads
     """
     fail = 0
     count = 0
-    for _, row in data.iterrows():
-        if row['responses'] == FAILSTRING:
-            try: 
-                prompt = prompt_msg + row['prompts']
-                response = prompt_ChatGPT(prompt, temp, min_words)
-                row['responses'] = response
+    failed_idxs = data.index[data['responses'] == FAILSTRING]
+
+    def repair_row(i):
+        # build the prompt inside the worker so a malformed row (e.g. NaN
+        # prompt) counts as a failure instead of aborting the whole run
+        return prompt_ChatGPT(prompt_msg + data.at[i, 'prompts'], temp, min_words)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(repair_row, i): i for i in failed_idxs}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                data.at[i, 'responses'] = future.result()
                 count += 1
             except:
-                print(f'The prompt: {prompt} did not successfully get a response from ChatGPT.\n')
+                print(f'The prompt: {data.at[i, "prompts"]} did not successfully get a response from ChatGPT.\n')
                 fail += 1
-                continue
     print(f'Successfully got {count} responses from ChatGPT, failed to get {fail} responses.')
     return data
 
@@ -132,46 +153,66 @@ def prompt_ChatGPT(prompt: str, temp: float, min_words=250, postprocess=process_
         if response_len != 0:
             msgs.append(CONTINUE)
         r = openai.ChatCompletion.create(model='gpt-3.5-turbo', messages=msgs, temperature=temp)
-        USAGE += r['usage']['total_tokens']
+        with USAGE_LOCK:
+            USAGE += r['usage']['total_tokens']
         msgs.append(r['choices'][0]['message'])
         this_len = len(msgs[-1]['content'].split())
         response_len += this_len
-    
+
     response = ' '.join([msg for msg in msgs if msg['role'] == 'assistant'])
     return postprocess(response)
 
-def merge_human_sampled(original_file, original_cols, sampled_file, sampled_cols, outfile=None):
+def merge_human_sampled(original_file, original_cols, sampled_file, sampled_cols, outfile=None, chunksize=100_000):
     """
     DESC: Given files of both original and sampled data,
-    merge them into one dataFrame.
-    PARAMS: 
+    merge them into one dataFrame. Files are streamed chunk by chunk
+    and only the requested columns are read, so peak memory stays
+    O(chunk) instead of O(file).
+    PARAMS:
     original_file, sampled_file: file of human data, chatGPT data resp.
-    original_cols, sampled_cols: list of cols to read in from original_file, sampled_file resp. 
+    original_cols, sampled_cols: list of cols to read in from original_file, sampled_file resp.
         if there are multiple columns, they're concatenated with a space separating the strings in each.
-    outfile: where to write merged data
-    RETURNS: dataFrame of merged data
+    outfile: where to write merged data; when given, chunks stream straight
+        to disk and peak memory stays O(chunk)
+    chunksize: rows to read from each file at a time
+    RETURNS: dataFrame of merged data, or None when outfile is given
     """
-    original = pd.read_csv(original_file)
-    sampled = pd.read_csv(sampled_file)
-    
     if original_cols is None:
-        original_cols = original.columns
+        original_cols = pd.read_csv(original_file, nrows=0).columns.tolist()
     if sampled_cols is None:
-        sampled_cols = sampled.columns
+        sampled_cols = pd.read_csv(sampled_file, nrows=0).columns.tolist()
+
+    def cat_cols(frame, cols):
+        # vectorized concat: one C-level pass instead of a Python call per row
+        if len(cols) == 1:
+            return frame[cols[0]]
+        return frame[cols[0]].str.cat(frame[list(cols[1:])], sep=' ')
 
-    original['original'] = original.apply(lambda row: concat_cols(row, original_cols), axis=1)
-    sampled['sampled'] = sampled.apply(lambda row: concat_cols(row, sampled_cols), axis=1)
-    df = pd.concat([original['original'], sampled['sampled']], axis=1)
-    df = match_lengths(df, 'original', 'sampled')
+    merged = []
+    first = True
+    originals = pd.read_csv(original_file, usecols=list(original_cols), chunksize=chunksize)
+    sampleds = pd.read_csv(sampled_file, usecols=list(sampled_cols), chunksize=chunksize)
+    for original, sampled in zip(originals, sampleds, strict=True):
+        assert len(original) == len(sampled), 'original and sampled files must line up row for row'
+        # build the two-column frame directly rather than concatenating,
+        # skipping pd.concat's index alignment and block consolidation
+        chunk = pd.DataFrame({'original': cat_cols(original, original_cols).values,
+                              'sampled': cat_cols(sampled, sampled_cols).values})
+        chunk = match_lengths(chunk, 'original', 'sampled')
+        if outfile:   # append as we go so the full output never has to sit in RAM
+            chunk.to_csv(outfile, mode='w' if first else 'a', header=first, index=False)
+            first = False
+        else:
+            merged.append(chunk)
     if outfile:
-        df.to_csv(outfile, index=False)
-    return df
+        return None
+    return pd.concat(merged, ignore_index=True)
 
 
 def strip_text(file, col, strip_msg):
     df = pd.read_csv(file)
     assert col in df.columns, 'invalid column called for this dataFrame'
-    df[col] = df.apply(lambda row: row[col].replace(strip_msg, ''), axis=1)
+    df[col] = df[col].str.replace(strip_msg, '', regex=False)
     df.to_csv(file, index=False)
     print(f'Stripped the text \'{strip_msg}\' from {file} in column {col}')
     
@@ -25,7 +25,7 @@ import os
 import openai
 from datasets import load_dataset
 from torch import cuda
-from data_processing import process_spaces, match_lengths
+from data_processing import process_spaces, process_spaces_series, match_lengths
 from argparse import ArgumentParser
 
 USAGE = 0
@@ -109,7 +109,7 @@ def load_human_data(file, num_examples):
     return df.loc[:num_examples]
 
 
-def xsum_load(infile=None, outfile=None, num_examples=500, preprocess=process_spaces):
+def xsum_load(infile=None, outfile=None, num_examples=500, preprocess=process_spaces_series):
     """
     DESC: Download XSum from HuggingFace datasets hub, or load from file.
     PARAMS:
@@ -123,7 +123,7 @@ def xsum_load(infile=None, outfile=None, num_examples=500, preprocess=process_sp
         return load_human_data(infile, num_examples)
     xsum_dict = load_dataset('xsum')
     xsum = xsum_dict['train']
-    articles = [preprocess(xsum[idx]['document']) for idx in random.sample(range(len(xsum)), num_examples)]
+    articles = preprocess(pd.Series([xsum[idx]['document'] for idx in random.sample(range(len(xsum)), num_examples)]))
     df = pd.DataFrame({'articles': articles})
     if outfile:
         df.to_csv(outfile, index=False)
@@ -164,7 +164,7 @@ def xsum_generate(xsum: pd.DataFrame, temp: float, tokens=30, prompt_msg='', min
 
 
 
-def squad_load(infile=None, outfile=None, num_examples=500, preprocess=process_spaces):
+def squad_load(infile=None, outfile=None, num_examples=500, preprocess=process_spaces_series):
     """
     DESC: Download SQuAD from HuggingFace hub, or from file.
     Sample num_examples if downloading.
@@ -181,9 +181,9 @@ def squad_load(infile=None, outfile=None, num_examples=500, preprocess=process_s
     squad_dict = load_dataset("squad")
     squad = squad_dict['train']
     idxs = random.sample(range(len(squad)), num_examples)
-    contexts = [preprocess(squad[idx]['context']) for idx in idxs]
-    questions = [preprocess(squad[idx]['question']) for idx in idxs]
-    answers = [preprocess(squad[idx]['answers']['text'][0]) for idx in idxs]
+    contexts = preprocess(pd.Series([squad[idx]['context'] for idx in idxs]))
+    questions = preprocess(pd.Series([squad[idx]['question'] for idx in idxs]))
+    answers = preprocess(pd.Series([squad[idx]['answers']['text'][0] for idx in idxs]))
     df = pd.DataFrame({'contexts': contexts, 'questions': questions, 'answers': answers})
     if outfile:
         df.to_csv(outfile, index=False)
@@ -228,9 +228,6 @@ def wp_load(infile: str, num_examples, outfile=None, load=False):
     split = infile.find(' ')
     source, target = infile[:split], infile[split+1:]
 
-    def remove_prompt_tag(string):   # implementation of this utility from Mitchell et al.
-        return string.replace('[ WP ]', '')
-    
     prompts = []
     stories = []
     with open(source) as src, open(target) as tgt:
@@ -240,8 +237,9 @@ def wp_load(infile: str, num_examples, outfile=None, load=False):
     filtered = [(prompt, story) for prompt, story in zip(prompts, stories) if prompt.startswith('[ WP ]')]
     filtered = [filtered[idx] for idx in random.sample(range(len(filtered)), num_examples)]
     prompts, stories = zip(*filtered)
-    prompts = [remove_prompt_tag(process_spaces(prompt)).strip() for prompt in prompts]
-    stories = [process_spaces(story).strip() for story in stories]
+    # clean whole columns at once; drop the [ WP ] tag (utility from Mitchell et al.)
+    prompts = process_spaces_series(pd.Series(prompts)).str.replace('[ WP ]', '', regex=False).str.strip()
+    stories = process_spaces_series(pd.Series(stories))
     df = pd.DataFrame({'prompts': prompts, 'stories': stories})
     if outfile:
         df.to_csv(outfile, index=False)
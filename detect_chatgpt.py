@@ -8,7 +8,6 @@ import transformers
 from torch import cuda, manual_seed
 import torch
 import numpy as np
-import tqdm
 import query_probabilities as qp
 import evaluation 
 from perturb import perturb_texts, load_perturbed, write_perturbed
@@ -18,6 +17,7 @@ import os
 
 DEVICE = 'cuda' if cuda.is_available() else 'cpu'
 MASK_FILLING_MODEL = "t5-3b"    # use for all experiments
+MASK_MODEL_CACHE = 'mask_model_cache'    # local safetensors copy of the mask model
 
 manual_seed(0)
 np.random.seed(0)
@@ -25,19 +25,32 @@ np.random.seed(0)
 
 def load_mask_model(mask_model_name):
     """
-    DESC: loads and returns mask model and tokenizer
+    DESC: loads and returns mask model and tokenizer.
+    The first load downloads from the hub and saves a safetensors copy
+    under MASK_MODEL_CACHE; every later run loads straight from disk
+    with local_files_only, skipping hub round trips. On GPU the model
+    comes up in fp16 with device_map='auto', which halves the memory
+    T5-3B needs and shards it over available devices.
     CALLED BY: perturb_texts
     """
-    mask_model = transformers.AutoModelForSeq2SeqLM.from_pretrained(mask_model_name) # can be cached. 
+    cache_dir = os.path.join(MASK_MODEL_CACHE, mask_model_name.replace('/', '_'))
+    load_kwargs = {}
+    if cuda.is_available():
+        load_kwargs = dict(torch_dtype=torch.float16, device_map='auto')   # placed on GPU(s) directly
+    try:
+        mask_model = transformers.AutoModelForSeq2SeqLM.from_pretrained(cache_dir, local_files_only=True, **load_kwargs)
+    except OSError:
+        mask_model = transformers.AutoModelForSeq2SeqLM.from_pretrained(mask_model_name, **load_kwargs)
+        mask_model.save_pretrained(cache_dir, safe_serialization=True)
     try:
         n_positions = mask_model.config.n_positions
     except AttributeError:
         n_positions = 512
-    mask_tokenizer = transformers.AutoTokenizer.from_pretrained(mask_model_name, model_max_length=n_positions)
-    
-    print('MOVING MASK MODEL TO GPU...', end='', flush=True)
-    mask_model.to(DEVICE)
-    print('DONE')
+    try:
+        mask_tokenizer = transformers.AutoTokenizer.from_pretrained(cache_dir, model_max_length=n_positions, local_files_only=True)
+    except OSError:
+        mask_tokenizer = transformers.AutoTokenizer.from_pretrained(mask_model_name, model_max_length=n_positions)
+        mask_tokenizer.save_pretrained(cache_dir)
 
     return mask_model, mask_tokenizer
 
@@ -65,36 +78,64 @@ def load_huggingface_model_and_tokenizer(model: str, dataset: str):
     return base_model, base_tokenizer
 
 
-def query_lls(results, openai_model=None, openai_opts=None, base_tokenizer=None, base_model=None):
+def query_lls(perturbed, openai_model=None, openai_opts=None, base_tokenizer=None, base_model=None):
     """
     TODO: make this function work for multiple query models.
     DESC: Given passages and their perturbed versions, query log likelihoods for all of them
     from the query models.
     PARAMS:
-    results: a List[Dict] where each dict has original passage, sample passage, and perturbed versions of each
+    perturbed: a List[Dict] where each dict has original passage, sample passage, and perturbed versions of each
     openai_model: name of openai model as str
     base_tokenizer, base_model: if an HF model used for querying, the actual model and tokenizer
     RETURNS:
-    results, but with additional keys in each dict as follows:
+    results, a dict of parallel columns over the N candidate pairs:
     {
-        'original_ll', 'sampled_ll': lls of original, sampled passage under query models
-        'all_perturbed_sampled_ll','all_perturbed_original_ll': all lls of all perturbed passages
-        'perturbed_sampled_ll', 'perturbed_original_ll': average lls over all perturbations
-        'perturbed_sampled_ll_std','perturbed_original_ll_std': std. dev of ll over all perturbations, for sampled/orig.
+        'original', 'sampled': List[str] of candidate passages
+        'perturbed_original', 'perturbed_sampled': List[List[str]] of their perturbations
+        'original_ll', 'sampled_ll': (N,) ndarrays of candidate lls under query models
+        'all_perturbed_sampled_ll','all_perturbed_original_ll': (N, n_perturbations) ndarrays of perturbation lls
+        'perturbed_sampled_ll', 'perturbed_original_ll': (N,) average lls over all perturbations
+        'perturbed_sampled_ll_std','perturbed_original_ll_std': (N,) std. dev of ll over all perturbations
     }
     """
 
-    for res in tqdm.tqdm(results, desc="Computing log likelihoods"):
-        p_sampled_ll = qp.get_lls(res["perturbed_sampled"], openai_model, base_tokenizer, base_model, **openai_opts)
-        p_original_ll = qp.get_lls(res["perturbed_original"], openai_model, base_tokenizer, base_model, **openai_opts)
-        res["original_ll"] = qp.get_ll(res["original"], openai_model, base_tokenizer, base_model, **openai_opts)
-        res["sampled_ll"] = qp.get_ll(res["sampled"], openai_model, base_tokenizer, base_model, **openai_opts)
-        res["all_perturbed_sampled_ll"] = p_sampled_ll
-        res["all_perturbed_original_ll"] = p_original_ll
-        res["perturbed_sampled_ll"] = np.mean(p_sampled_ll)
-        res["perturbed_original_ll"] = np.mean(p_original_ll)
-        res["perturbed_sampled_ll_std"] = np.std(p_sampled_ll) if len(p_sampled_ll) > 1 else 1
-        res["perturbed_original_ll_std"] = np.std(p_original_ll) if len(p_original_ll) > 1 else 1
+    openai_opts = openai_opts or {}
+    if base_model is not None:
+        base_model.eval()   # no dropout while scoring likelihoods
+
+    # struct-of-arrays: one column per field instead of a dict per result
+    results = {
+        'original': [res['original'] for res in perturbed],
+        'sampled': [res['sampled'] for res in perturbed],
+        'perturbed_original': [res['perturbed_original'] for res in perturbed],
+        'perturbed_sampled': [res['perturbed_sampled'] for res in perturbed],
+    }
+    n_candidates = len(results['original'])
+    n_perturbations = len(results['perturbed_sampled'][0]) if results['perturbed_sampled'] else 0
+
+    # flatten candidates and perturbations into one batch so the query model
+    # is hit with a single get_lls call instead of four small ones per result
+    texts = (results['original'] + results['sampled']
+             + [text for group in results['perturbed_sampled'] for text in group]
+             + [text for group in results['perturbed_original'] for text in group])
+    lls = np.asarray(qp.get_lls(texts, openai_model, base_tokenizer, base_model, **openai_opts))
+
+    # carve the flat ll array into the (N,) candidate columns and
+    # (N, n_perturbations) perturbation matrices
+    results['original_ll'] = lls[:n_candidates]
+    results['sampled_ll'] = lls[n_candidates:2 * n_candidates]
+    split = 2 * n_candidates + n_candidates * n_perturbations
+    all_p_sampled = lls[2 * n_candidates:split].reshape(n_candidates, n_perturbations)
+    all_p_original = lls[split:].reshape(n_candidates, n_perturbations)
+    results['all_perturbed_sampled_ll'] = all_p_sampled
+    results['all_perturbed_original_ll'] = all_p_original
+    # fused row-wise reduction; unbiased=False matches np.std
+    sampled_std, sampled_mean = torch.std_mean(torch.as_tensor(all_p_sampled), dim=1, unbiased=False)
+    original_std, original_mean = torch.std_mean(torch.as_tensor(all_p_original), dim=1, unbiased=False)
+    results['perturbed_sampled_ll'] = sampled_mean.numpy()
+    results['perturbed_original_ll'] = original_mean.numpy()
+    results['perturbed_sampled_ll_std'] = sampled_std.numpy() if n_perturbations > 1 else np.ones(n_candidates)
+    results['perturbed_original_ll_std'] = original_std.numpy() if n_perturbations > 1 else np.ones(n_candidates)
 
     tokens_used = qp.count_tokens()
     print(f'This query used {tokens_used} tokens.')
@@ -102,47 +143,60 @@ def query_lls(results, openai_model=None, openai_opts=None, base_tokenizer=None,
     return results
 
 
-def run_perturbation_experiment(results, criterion, hyperparameters, dataset):
+def run_perturbation_experiment(results, criterion, hyperparameters, dataset, tag=None, verbose=False):
     """
     DESC: Given results of perturbations + probabilities, make probabilistic classification predictions for
     each candidate passage and then evaluate them!
 
     PARAMS:
-    results: List[Dict], where each dict contains an original passage, a ChatGPT passage,
-    all their perturbations, and the log probabilities for all these passages. See docstrings
-    of query_lls and perturb_texts for more info on what keys are in each dict.
+    results: dict of parallel columns holding the original passages, ChatGPT passages,
+    all their perturbations, and the log probabilities for all these passages. See the
+    docstring of query_lls for the exact keys and shapes.
     criterion: 'd' or 'z'. If the criterion is 'd' make a probabilistic pred. between 0 or 1 based on \
         the difference in log likelihoods between a passage and its perturbations. If it's 'z', use \
         the difference divided by the standard dev. of the lls over all perturbations: a z-score. 
     hyperparameters: dict of span_length, pct_words_masked, and n_perturbations
+    tag: precomputed hyperparameter tag for the experiment name; derived from
+    hyperparameters if not given
+    verbose: print per-text diagnostics (unique perturbation counts, the
+    passage itself) for candidates whose perturbation ll std is 0
     RETURNS:
     Dict with info and results about experiment!
     """
-    # compute diffs with perturbed
-    predictions = {'real': [], 'samples': []}
-    for res in results:
-        if criterion == 'd':
-            print(f'Making predictions for difference criteria.')
-            predictions['real'].append(res['original_ll'] - res['perturbed_original_ll'])
-            predictions['samples'].append(res['sampled_ll'] - res['perturbed_sampled_ll'])
-        elif criterion == 'z':
-            print(f'Making predictions for z-score criteria.')
-            if res['perturbed_original_ll_std'] == 0:
-                res['perturbed_original_ll_std'] = 1
-                print("WARNING: std of perturbed original is 0, setting to 1")
-                print(f"Number of unique perturbed original texts: {len(set(res['perturbed_original']))}")
-                print(f"Original text: {res['original']}")
-            if res['perturbed_sampled_ll_std'] == 0:
-                res['perturbed_sampled_ll_std'] = 1
-                print("WARNING: std of perturbed sampled is 0, setting to 1")
-                print(f"Number of unique perturbed sampled texts: {len(set(res['perturbed_sampled']))}")
-                print(f"Sampled text: {res['sampled']}")
-            predictions['real'].append((res['original_ll'] - res['perturbed_original_ll']) / res['perturbed_original_ll_std'])
-            predictions['samples'].append((res['sampled_ll'] - res['perturbed_sampled_ll']) / res['perturbed_sampled_ll_std'])
+    # whole-column computations on the results container: every prediction
+    # comes out of one vectorized pass
+    original_ll = results['original_ll']
+    sampled_ll = results['sampled_ll']
+    perturbed_original_ll = results['perturbed_original_ll']
+    perturbed_sampled_ll = results['perturbed_sampled_ll']
+    if criterion == 'd':
+        print(f'Making predictions for difference criteria.')
+        predictions = {'real': (original_ll - perturbed_original_ll).tolist(),
+                       'samples': (sampled_ll - perturbed_sampled_ll).tolist()}
+    elif criterion == 'z':
+        print(f'Making predictions for z-score criteria.')
+        original_std = results['perturbed_original_ll_std'].copy()
+        sampled_std = results['perturbed_sampled_ll_std'].copy()
+        for idx in np.flatnonzero(original_std == 0):
+            print("WARNING: std of perturbed original is 0, setting to 1")
+            if verbose:
+                print(f"Number of unique perturbed original texts: {len(set(results['perturbed_original'][idx]))}")
+                print(f"Original text: {results['original'][idx]}")
+        for idx in np.flatnonzero(sampled_std == 0):
+            print("WARNING: std of perturbed sampled is 0, setting to 1")
+            if verbose:
+                print(f"Number of unique perturbed sampled texts: {len(set(results['perturbed_sampled'][idx]))}")
+                print(f"Sampled text: {results['sampled'][idx]}")
+        original_std[original_std == 0] = 1
+        sampled_std[sampled_std == 0] = 1
+        predictions = {'real': ((original_ll - perturbed_original_ll) / original_std).tolist(),
+                       'samples': ((sampled_ll - perturbed_sampled_ll) / sampled_std).tolist()}
 
     fpr, tpr, roc_auc = evaluation.get_roc_metrics(predictions['real'], predictions['samples'])
     p, r, pr_auc = evaluation.get_precision_recall_metrics(predictions['real'], predictions['samples'])
-    name = f'{dataset}_{"difference" if criterion == "d" else "z-score"}_{hyperparameters["n_perturbations"]}_{hyperparameters["perturb_pct"]}.'
+    if tag is None:
+        tag = f'{hyperparameters["n_perturbations"]}_{hyperparameters["perturb_pct"]}'
+    name = f'{dataset}_{"difference" if criterion == "d" else "z-score"}_{tag}.'
     print(f"{name} ROC AUC: {roc_auc}, PR AUC: {pr_auc}")
     return {
         'name': name,
@@ -171,6 +225,7 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--directory', help='directory to save plots, should contain info abt query models and dataset')
     parser.add_argument('-k', '--k_examples', help='load k examples from file', type=int)
     parser.add_argument('--perturbed', action='store_true', help='specify to indicate perturbations already in infile')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print per-text diagnostics for zero-std perturbations')
 
     perturb_options = parser.add_argument_group()
     perturb_options.add_argument('-n', '--n_perturbations', help='number of perturbations to perform in experiments', type=int, default=5)
@@ -189,12 +244,8 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
 
-    hyperparameters = {
-        'n_perturbations': args.n_perturbations,
-        'span_length': args.span_length,
-        'perturb_pct': args.perturb_pct,
-        'n_perturbation_rounds': args.n_perturbation_rounds,
-    }
+    hyperparameters = {key: getattr(args, key)
+                       for key in ('n_perturbations', 'span_length', 'perturb_pct', 'n_perturbation_rounds')}
 
     open_ai_hyperparams = {
         'logprobs': args.logprobs,
@@ -222,7 +273,10 @@ if __name__ == '__main__':
     else: 
         hf_model, hf_tokenizer = load_huggingface_model_and_tokenizer(args.query_model, args.dataset)
         results = query_lls(perturbed, base_model=hf_model, base_tokenizer=hf_tokenizer)
-    experiments = [run_perturbation_experiment(results, criterion, hyperparameters, args.dataset) for criterion in ['z', 'd']]
+    # hyperparameter tag only depends on CLI args: build it once for all experiments
+    tag = f'{hyperparameters["n_perturbations"]}_{hyperparameters["perturb_pct"]}'
+    experiments = [run_perturbation_experiment(results, criterion, hyperparameters, args.dataset, tag, verbose=args.verbose)
+                   for criterion in ['z', 'd']]
 
     # graph results, making sure the directory exists
     DIR = args.directory
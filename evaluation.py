@@ -84,14 +84,14 @@ def save_ll_histograms(experiments, save_dir):
             # plot histogram of sampled/perturbed sampled on left, original/perturbed original on right
             plt.figure(figsize=(20, 6))
             plt.subplot(1, 2, 1)
-            plt.hist([r["sampled_ll"] for r in results], alpha=0.5, bins='auto', label='sampled')
-            plt.hist([r["perturbed_sampled_ll"] for r in results], alpha=0.5, bins='auto', label='perturbed sampled')
+            plt.hist(results["sampled_ll"], alpha=0.5, bins='auto', label='sampled')
+            plt.hist(results["perturbed_sampled_ll"], alpha=0.5, bins='auto', label='perturbed sampled')
             plt.xlabel("log likelihood")
             plt.ylabel('count')
             plt.legend(loc='upper right')
             plt.subplot(1, 2, 2)
-            plt.hist([r["original_ll"] for r in results], alpha=0.5, bins='auto', label='original')
-            plt.hist([r["perturbed_original_ll"] for r in results], alpha=0.5, bins='auto', label='perturbed original')
+            plt.hist(results["original_ll"], alpha=0.5, bins='auto', label='original')
+            plt.hist(results["perturbed_original_ll"], alpha=0.5, bins='auto', label='perturbed original')
             plt.xlabel("log likelihood")
             plt.ylabel('count')
             plt.legend(loc='upper right')
@@ -115,13 +115,12 @@ def save_llr_histograms(experiments, save_dir):
             plt.figure(figsize=(20, 6))
             plt.subplot(1, 2, 1)
 
-            # compute the log likelihood ratio for each result
-            for r in results:
-                r["sampled_llr"] = r["sampled_ll"] - r["perturbed_sampled_ll"]
-                r["original_llr"] = r["original_ll"] - r["perturbed_original_ll"]
-            
-            plt.hist([r["sampled_llr"] for r in results], alpha=0.5, bins='auto', label='sampled')
-            plt.hist([r["original_llr"] for r in results], alpha=0.5, bins='auto', label='original')
+            # compute the log likelihood ratios as whole columns
+            results["sampled_llr"] = results["sampled_ll"] - results["perturbed_sampled_ll"]
+            results["original_llr"] = results["original_ll"] - results["perturbed_original_ll"]
+
+            plt.hist(results["sampled_llr"], alpha=0.5, bins='auto', label='sampled')
+            plt.hist(results["original_llr"], alpha=0.5, bins='auto', label='original')
             plt.xlabel("log likelihood ratio")
             plt.ylabel('count')
             plt.legend(loc='upper right')
@@ -25,7 +25,7 @@ def load_data(filename, k=None):
     From data_processing, copied here to avoid having to import
     and create package issues on GPUs.
     """
-    df = pd.read_csv(filename)
+    df = pd.read_csv(filename, engine='pyarrow')   # multithreaded native parse
     assert 'original' in df.columns and 'sampled' in df.columns, 'files need to have original and sampled cols'
     print(f'Loading data from {filename}.')
     conv = {'original': df['original'].values.tolist(),
@@ -273,13 +273,18 @@ def perturb_texts(data, mask_model, mask_tokenizer, chunk_size=50,
     perturb_fn = functools.partial(generate_perturbations, span_length=span_length, pct=perturb_pct,
                                    mask_model=mask_model, mask_tokenizer=mask_tokenizer, chunk_size=chunk_size)
 
-    p_sampled_text = perturb_fn([x for x in sampled_text for _ in range(n_perturbations)])
-    p_original_text = perturb_fn([x for x in original_text for _ in range(n_perturbations)])
+    # perturb sampled and original texts as one fused batch so the mask model
+    # sees full chunks throughout instead of two separately padded streams
+    n_sampled = len(sampled_text) * n_perturbations
+    combined = [x for x in sampled_text for _ in range(n_perturbations)] + \
+               [x for x in original_text for _ in range(n_perturbations)]
+    p_combined = perturb_fn(combined)
     for _ in range(n_perturbation_rounds - 1):
         try:
-            p_sampled_text, p_original_text = perturb_fn(p_sampled_text), perturb_fn(p_original_text)
+            p_combined = perturb_fn(p_combined)
         except AssertionError:
             break
+    p_sampled_text, p_original_text = p_combined[:n_sampled], p_combined[n_sampled:]
 
     assert len(p_sampled_text) == len(sampled_text) * n_perturbations, f"Expected {len(sampled_text) * n_perturbations} perturbed samples, got {len(p_sampled_text)}"
     assert len(p_original_text) == len(original_text) * n_perturbations, f"Expected {len(original_text) * n_perturbations} perturbed samples, got {len(p_original_text)}"